@@ -7,158 +7,662 @@ Uses GPT5-nano to:
 3. Clean up any obvious issues
 
 Usage:
-    python llm_polish.py [--dry-run] [--limit N]
+    python llm_polish.py [--dry-run] [--limit N] [--batch]
 """
 
 import argparse
+import functools
+import hashlib
 import json
 import os
 import re
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
-# Load env
-env_vars = {}
-try:
-    with open('.env', 'r') as f:
-        for line in f:
-            if '=' in line and not line.startswith('#'):
-                k, v = line.strip().split('=', 1)
-                env_vars[k] = v.strip('"').strip("'")
-except:
-    pass
+from sync_to_supabase import is_valid_person_name
 
-OPENAI_API_KEY = env_vars.get('OPENAI_API_KEY') or os.getenv('OPENAI_API_KEY')
-OPENAI_MODEL = env_vars.get('LLM_POLISH_MODEL') or 'gpt-5-nano'
-SUPABASE_URL = env_vars.get('SUPABASE_URL') or os.getenv('SUPABASE_URL')
-SUPABASE_KEY = env_vars.get('SUPABASE_KEY') or env_vars.get('SUPABASE_ANON_KEY') or os.getenv('SUPABASE_KEY')
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+_ENV_LINE_RE = re.compile(r'^([A-Z_][A-Z0-9_]*)=(.*)$', re.M)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_env() -> None:
+    """Load .env into os.environ once; real environment variables win."""
+    env_path = Path('.env')
+    data = env_path.read_text() if env_path.exists() else ''
+    for match in _ENV_LINE_RE.finditer(data):
+        os.environ.setdefault(match.group(1), match.group(2).strip().strip('"\''))
+
+
+_load_env()
+
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+DEFAULT_MODEL = os.environ.get('LLM_POLISH_MODEL') or os.environ.get('OPENAI_MODEL') or 'gpt-5-nano'
+SUPABASE_URL = os.environ.get('SUPABASE_URL')
+SUPABASE_KEY = os.environ.get('SUPABASE_KEY') or os.environ.get('SUPABASE_ANON_KEY')
+
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+BATCH_INPUT_PATH = Path("batch.jsonl")
+CACHE_PATH = Path("llm_polish_cache.db")
+MAX_WORKERS = 20
+GROUP_SIZE = 15
+# Answers are one-field JSON objects, well under 20 tokens each
+MAX_OUT_TOKENS = 60
+# o1 models can't turn reasoning down, so they keep room for hidden reasoning
+# tokens on top of the answer
+REASONING_HEADROOM = 1000
+UPSERT_CHUNK_SIZE = 500
+
+# One keep-alive session shared by all worker threads and both hosts, so calls
+# reuse open TLS connections instead of handshaking per lead.
+# Transient faults (timeouts, rate limits, 5xx) are retried with exponential
+# backoff; anything else, e.g. a 400, fails immediately
+RETRY = Retry(
+    total=5,
+    backoff_factor=1.0,
+    status_forcelist=[408, 429, 500, 502, 503, 504],
+    allowed_methods=["POST", "PATCH", "GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=RETRY))
+
+# Uploading a batch file or creating a batch is not idempotent - a retried
+# POST after a lost response would start a second, separately billed batch -
+# so those calls go through a session that only retries reads.
+BATCH_SESSION = requests.Session()
+BATCH_SESSION.mount("https://", HTTPAdapter(max_retries=RETRY.new(allowed_methods=["GET"])))
+
+# The two hosts need different auth, so headers are built once here rather
+# than set on the shared session.
+OPENAI_HEADERS = {
+    "Authorization": f"Bearer {OPENAI_API_KEY}",
+    "Content-Type": "application/json"
+}
+SUPABASE_HEADERS = {
+    'apikey': SUPABASE_KEY,
+    'Authorization': f'Bearer {SUPABASE_KEY}'
+}
+
+
+# Forced function calls bind the answer shape, so the model always returns
+# valid JSON arguments instead of prose we have to dig JSON out of
+TOOLS = {
+    "emit": {
+        "type": "function",
+        "function": {
+            "name": "emit",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "chinese_staff": {"type": ["string", "null"]},
+                    "valid": {"type": "boolean"},
+                },
+            },
+        },
+    },
+    "emit_batch": {
+        "type": "function",
+        "function": {
+            "name": "emit_batch",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "items": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": ["integer", "string"]},
+                                "chinese_staff": {"type": ["string", "null"]},
+                            },
+                        },
+                    },
+                },
+            },
+        },
+    },
+}
 
 
-def call_llm(prompt: str, system: str = None) -> str:
-    """Call OpenAI API."""
+def build_payload(
+    prompt: str, system: str = None, max_out: int = MAX_OUT_TOKENS, tool: str = "emit", model: str = DEFAULT_MODEL
+) -> dict:
+    """Build the chat completions request body."""
     messages = []
     if system:
         messages.append({"role": "system", "content": system})
     messages.append({"role": "user", "content": prompt})
 
     payload = {
-        "model": OPENAI_MODEL,
+        "model": model,
         "messages": messages,
+        "tools": [TOOLS[tool]],
+        "tool_choice": {"type": "function", "function": {"name": tool}},
     }
     # GPT-5/o1 models have different parameter requirements
-    if "gpt-5" in OPENAI_MODEL or "o1" in OPENAI_MODEL:
-        # gpt-5-nano uses reasoning tokens internally, needs more headroom
-        payload["max_completion_tokens"] = 1000
+    if "gpt-5" in model:
+        payload["max_completion_tokens"] = max_out
+        # Reasoning tokens dominate latency and these answers don't need them
+        payload["reasoning_effort"] = "minimal"
+    elif "o1" in model:
+        payload["max_completion_tokens"] = max_out + REASONING_HEADROOM
     else:
-        payload["max_tokens"] = 500
+        payload["max_tokens"] = max_out
         payload["temperature"] = 0
+    return payload
 
-    resp = requests.post(
-        "https://api.openai.com/v1/chat/completions",
-        headers={
-            "Authorization": f"Bearer {OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        },
-        json=payload,
+
+def message_text(message: dict) -> str:
+    """Return the forced tool call's JSON arguments (or plain content as a fallback)."""
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        return tool_calls[0]["function"]["arguments"]
+    return message.get("content") or ""
+
+
+def call_llm(
+    prompt: str, system: str = None, max_out: int = MAX_OUT_TOKENS, tool: str = "emit", model: str = DEFAULT_MODEL
+) -> str:
+    """Call OpenAI API."""
+    resp = SESSION.post(
+        f"{OPENAI_BASE_URL}/chat/completions",
+        headers=OPENAI_HEADERS,
+        json=build_payload(prompt, system, max_out, tool, model),
         timeout=30
     )
     resp.raise_for_status()
-    return resp.json()["choices"][0]["message"]["content"]
+    return message_text(resp.json()["choices"][0]["message"])
 
 
-SYSTEM_PROMPT = """You are a data quality assistant validating contact information.
+_cache_conn = None
+_cache_lock = threading.Lock()
 
-RULES:
-1. Return FULL names (First Last), never just surnames
-2. REJECT organization names, program names, locations
-3. For Chinese rep candidates, identify the Chinese staff member and return their FULL name
-4. Return JSON only, no explanations
 
-Chinese surnames: Chan, Chen, Cheung, Chow, Chu, Fung, Ho, Huang, Lam, Lee, Leung, Li, Lin, Liu, Lo, Mak, Ng, Tang, Tse, Wong, Wu, Yang, Yip, Yu, Zhang, Zhao, Zhou, Tsang, Yan"""
+def _cache() -> sqlite3.Connection:
+    """Open the on-disk response cache (shared by all worker threads)."""
+    global _cache_conn
+    if _cache_conn is None:
+        _cache_conn = sqlite3.connect(CACHE_PATH, check_same_thread=False)
+        _cache_conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response TEXT)")
+    return _cache_conn
 
 
-def polish_lead(lead: dict) -> dict:
-    """Polish a single lead with LLM validation."""
+def cache_key(prompt: str, system: str = None, tool: str = "emit", model: str = DEFAULT_MODEL) -> str:
+    """Key a response by everything that determines it."""
+    return hashlib.sha256(f"{model}|{tool}|{system or ''}|{prompt}".encode()).hexdigest()
+
+
+def cache_get(key: str) -> str | None:
+    """Look up a cached response."""
+    with _cache_lock:
+        row = _cache().execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def cache_put(key: str, response: str) -> None:
+    """Store a response in the cache."""
+    with _cache_lock:
+        conn = _cache()
+        conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?)", (key, response))
+        conn.commit()
+
+
+def is_complete_response(response: str, tool: str = "emit") -> bool:
+    """Check a response parses into the tool's shape, so empty or truncated
+    output is never cached."""
+    parsed = _first_json(response)
+    if tool == "emit_batch":
+        return isinstance(parsed, dict) and isinstance(parsed.get('items'), list)
+    return isinstance(parsed, dict)
+
+
+def call_llm_cached(
+    prompt: str, system: str = None, max_out: int = MAX_OUT_TOKENS, tool: str = "emit", model: str = DEFAULT_MODEL
+) -> str:
+    """call_llm, served from the on-disk cache when this prompt was seen before."""
+    key = cache_key(prompt, system, tool, model)
+    response = cache_get(key)
+    if response is None:
+        response = call_llm(prompt, system, max_out, tool, model)
+        if is_complete_response(response, tool):
+            cache_put(key, response)
+    return response
+
+
+_inflight_guard = threading.Lock()
+_inflight_locks = defaultdict(threading.Lock)
+
+
+@functools.lru_cache(maxsize=4096)
+def _call_llm_memo(prompt: str, system: str, max_out: int, tool: str, model: str) -> str:
+    return call_llm_cached(prompt, system, max_out, tool, model)
+
+
+def call_llm_memo(
+    prompt: str, system: str = None, max_out: int = MAX_OUT_TOKENS, tool: str = "emit", model: str = DEFAULT_MODEL
+) -> str:
+    """call_llm_cached, collapsing duplicate prompts within a run into one request."""
+    # Threads asking for the same prompt wait on the one in-flight call
+    # instead of each missing the memo and firing their own
+    key = (prompt, system, max_out, tool, model)
+    with _inflight_guard:
+        lock = _inflight_locks[key]
+    try:
+        with lock:
+            return _call_llm_memo(prompt, system, max_out, tool, model)
+    finally:
+        # Once answered the memo serves repeats, so drop the lock rather than
+        # keep one per prompt for the whole run
+        with _inflight_guard:
+            if _inflight_locks.get(key) is lock:
+                del _inflight_locks[key]
+
+
+SYSTEM_PROMPT = "You validate contact data. Names must be FULL human names (First Last), never organizations, programs or places."
+
+
+_DECODER = json.JSONDecoder()
+
+
+def _first_json(text: str):
+    """Decode the first JSON object in text, or None."""
+    i = text.find('{')
+    while i != -1:
+        try:
+            return _DECODER.raw_decode(text, i)[0]
+        except json.JSONDecodeError:
+            i = text.find('{', i + 1)
+    return None
+
+
+CHINESE_SURNAMES = frozenset({
+    "chan", "chen", "cheung", "chow", "chu", "fung", "ho", "huang", "lam", "lee",
+    "leung", "li", "lin", "liu", "lo", "mak", "ng", "tang", "tse", "wong",
+    "wu", "yang", "yip", "yu", "zhang", "zhao", "zhou", "tsang", "yan",
+})
+
+
+def staff_names(lead: dict) -> list:
+    """Names of the first few decision makers on a lead."""
+    return [d.get('name', '') for d in lead.get('decision_makers', [])[:5] if d.get('name')]
+
+
+def local_result(lead: dict) -> dict | None:
+    """Resolve a lead without the LLM when a deterministic check suffices."""
+    contact_name = lead.get('contact_name', '')
+    result = {}
+
+    if lead.get('chinese_rep_candidate', False):
+        for full_name in staff_names(lead):
+            tokens = full_name.split()
+            if len(tokens) > 1 and tokens[-1].lower() in CHINESE_SURNAMES:
+                if full_name != contact_name:
+                    result['chinese_staff_name'] = full_name
+                break
+        else:
+            return None
+    else:
+        # A plain "First Last" pair that also passes the sync's person-name
+        # filter (which rejects org/place words like "Home" or "Lodge") needs
+        # no second opinion; anything else goes to the LLM
+        tokens = (contact_name or '').split()
+        if len(tokens) != 2 or not all(t.isalpha() for t in tokens):
+            return None
+        if not is_valid_person_name(contact_name):
+            return None
+        result['contact_name_valid'] = True
+
+    return {
+        'id': lead.get('id'),
+        'name': lead.get('name', ''),
+        'original_contact': contact_name,
+        'chinese_rep': lead.get('chinese_rep_candidate', False),
+        'result': result
+    }
+
+
+# Prompt templates are rendered once here; only the lead fields vary per call
+PROMPT_CHINESE = """Contact: {contact}
+Staff: {staff}
+This is a Chinese rep lead. Who is the Chinese staff member? Return their FULL name.
+JSON: {{"chinese_staff": "full name or null"}}"""
+
+PROMPT_VALIDATE = """Is "{contact}" a valid human name (First Last format)?
+Not valid: organization names, program names, locations, partial titles.
+JSON: {{"valid": true/false}}"""
+
+PROMPT_CHINESE_GROUP = """These are Chinese rep leads. For each item, who is the Chinese staff member? Return their FULL name.
+Items: {items}"""
+
+
+def build_prompt(lead: dict) -> str:
+    """Build the user prompt for a single lead."""
+    contact_name = lead.get('contact_name', '')
+    if lead.get('chinese_rep_candidate', False):
+        # For Chinese rep, find the Chinese staff
+        return PROMPT_CHINESE.format(contact=contact_name, staff=', '.join(staff_names(lead)))
+    # Just validate the contact name
+    return PROMPT_VALIDATE.format(contact=contact_name)
+
+
+def build_group_prompt(leads: list) -> str:
+    """Build one user prompt covering several Chinese rep leads."""
+    items = [{"id": lead.get('id'), "staff": staff_names(lead)} for lead in leads]
+    return PROMPT_CHINESE_GROUP.format(items=json.dumps(items))
+
+
+def build_request(lead: dict, model: str = DEFAULT_MODEL) -> dict:
+    """Build one Batch API request line for a lead."""
+    return {
+        "custom_id": str(lead.get('id')),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": build_payload(build_prompt(lead), SYSTEM_PROMPT, model=model),
+    }
+
+
+def error_result(lead: dict, error: str) -> dict:
+    """Polish result for a lead that could not be processed."""
+    return {'id': lead.get('id'), 'name': lead.get('name', ''), 'error': error}
+
+
+def parse_response(lead: dict, response: str) -> dict:
+    """Turn a raw LLM response into a polish result for a lead."""
+    # Extract JSON from response
+    raw_result = _first_json(response)
+    if not isinstance(raw_result, dict):
+        return error_result(lead, 'No result')
+
+    return normalize_result(lead, raw_result)
+
+
+def normalize_result(lead: dict, raw_result: dict) -> dict:
+    """Normalize the model's JSON answer into a polish result."""
     lead_id = lead.get('id')
     name = lead.get('name', '')
     contact_name = lead.get('contact_name', '')
-    contact_role = lead.get('contact_role', '')
-    decision_makers = lead.get('decision_makers', [])
     chinese_rep = lead.get('chinese_rep_candidate', False)
-    chinese_reasons = lead.get('chinese_rep_reasons', [])
-    sales_brief = lead.get('sales_brief', '')
-
-    # Build simpler prompt for gpt-5-nano
-    dm_names = [d.get('name', '') for d in decision_makers[:5] if d.get('name')]
 
+    # Normalize result format
+    result = {}
     if chinese_rep:
-        # For Chinese rep, find the Chinese staff
-        prompt = f"""Contact: {contact_name}
-Staff: {', '.join(dm_names)}
-This is a Chinese rep lead. Chinese surnames: Lee, Chan, Chen, Wong, Wu, Li, Lin, Liu, Tsang, Yan, Ng, Tang, Ho.
-Who is the Chinese staff member? Return their FULL name.
-JSON: {{"chinese_staff": "full name or null"}}"""
+        chinese_staff = raw_result.get('chinese_staff')
+        if chinese_staff and chinese_staff != contact_name:
+            result['chinese_staff_name'] = chinese_staff
     else:
-        # Just validate the contact name
-        prompt = f"""Is "{contact_name}" a valid human name (First Last format)?
-Not valid: organization names, program names, locations, partial titles.
-JSON: {{"valid": true/false}}"""
+        result['contact_name_valid'] = raw_result.get('valid', True)
+
+    return {
+        'id': lead_id,
+        'name': name,
+        'original_contact': contact_name,
+        'chinese_rep': chinese_rep,
+        'result': result
+    }
 
+
+def polish_lead(lead: dict, model: str = DEFAULT_MODEL) -> dict:
+    """Polish a single lead with LLM validation."""
+    local = local_result(lead)
+    if local:
+        return local
     try:
-        response = call_llm(prompt, SYSTEM_PROMPT)
-        # Extract JSON from response
-        json_match = re.search(r'\{[^}]+\}', response, re.DOTALL)
-        if json_match:
-            raw_result = json.loads(json_match.group())
-
-            # Normalize result format
-            result = {}
-            if chinese_rep:
-                chinese_staff = raw_result.get('chinese_staff')
-                if chinese_staff and chinese_staff != contact_name:
-                    result['chinese_staff_name'] = chinese_staff
-            else:
-                result['contact_name_valid'] = raw_result.get('valid', True)
-
-            return {
-                'id': lead_id,
-                'name': name,
-                'original_contact': contact_name,
-                'chinese_rep': chinese_rep,
-                'result': result
-            }
-    except Exception as e:
-        return {
-            'id': lead_id,
-            'name': name,
-            'error': str(e)
-        }
-
-    return {'id': lead_id, 'name': name, 'error': 'No result'}
-
-
-def fetch_leads_from_supabase() -> list:
-    """Fetch leads from Supabase."""
-    resp = requests.get(
-        f'{SUPABASE_URL}/rest/v1/leads?select=*',
-        headers={
-            'apikey': SUPABASE_KEY,
-            'Authorization': f'Bearer {SUPABASE_KEY}'
-        }
+        response = call_llm_memo(build_prompt(lead), SYSTEM_PROMPT, max_out=MAX_OUT_TOKENS, model=model)
+        return parse_response(lead, response)
+    except requests.RequestException as e:
+        # Already retried by the session adapter if it was transient
+        return error_result(lead, f"Request failed: {e}")
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        return error_result(lead, f"Bad response: {e}")
+
+
+def polish_leads_batch(leads: list, model: str = DEFAULT_MODEL) -> list:
+    """Polish several Chinese rep leads with a single LLM call."""
+    results = []
+    pending = []
+    for lead in leads:
+        local = local_result(lead)
+        if local:
+            results.append(local)
+        else:
+            pending.append(lead)
+    if not pending:
+        return results
+
+    try:
+        response = call_llm_memo(
+            build_group_prompt(pending), SYSTEM_PROMPT, max_out=MAX_OUT_TOKENS * len(pending),
+            tool="emit_batch", model=model
+        )
+        items = (_first_json(response) or {}).get('items')
+        if not isinstance(items, list):
+            raise ValueError('No result')
+        by_id = {str(item.get('id')): item for item in items if isinstance(item, dict)}
+    except requests.RequestException as e:
+        return results + [error_result(lead, f"Request failed: {e}") for lead in pending]
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        return results + [error_result(lead, f"Bad response: {e}") for lead in pending]
+
+    for lead in pending:
+        raw_result = by_id.get(str(lead.get('id')))
+        if raw_result is None:
+            results.append(error_result(lead, 'No result'))
+        else:
+            results.append(normalize_result(lead, raw_result))
+    return results
+
+
+def group_leads(leads: list):
+    """Yield work units: Chinese rep leads in groups of GROUP_SIZE, others one at a time."""
+    chinese = []
+    for lead in leads:
+        if not lead.get('chinese_rep_candidate'):
+            yield [lead]
+            continue
+        chinese.append(lead)
+        if len(chinese) == GROUP_SIZE:
+            yield chinese
+            chinese = []
+    if chinese:
+        yield chinese
+
+
+def polish_group(group: list, model: str = DEFAULT_MODEL) -> list:
+    """Polish one work unit from group_leads."""
+    if group[0].get('chinese_rep_candidate'):
+        return polish_leads_batch(group, model)
+    return [polish_lead(group[0], model)]
+
+
+def batch_item_error(item: dict) -> str | None:
+    """Return a batch output/error line's error message, or None if it succeeded."""
+    response = item.get("response") or {}
+    error = item.get("error") or (response.get("body") or {}).get("error")
+    if isinstance(error, dict):
+        return error.get("message") or str(error)
+    if error:
+        return str(error)
+    if response.get("status_code") != 200:
+        return f"Batch request failed with status {response.get('status_code')}"
+    return None
+
+
+def run_batch(leads: list, model: str = DEFAULT_MODEL) -> list:
+    """Polish leads through the OpenAI Batch API (half price, separate rate limits)."""
+    # Multipart upload sets its own Content-Type, so only reuse the auth header
+    headers = {"Authorization": OPENAI_HEADERS["Authorization"]}
+
+    results = []
+    pending = []
+    for lead in leads:
+        local = local_result(lead)
+        if local:
+            results.append(local)
+            continue
+        cached = cache_get(cache_key(build_prompt(lead), SYSTEM_PROMPT, model=model))
+        if cached is not None:
+            results.append(parse_response(lead, cached))
+        else:
+            pending.append(lead)
+    if not pending:
+        return results
+    leads = pending
+
+    with BATCH_INPUT_PATH.open("w", encoding="utf-8") as f:
+        for lead in leads:
+            f.write(json.dumps(build_request(lead, model)) + "\n")
+
+    with BATCH_INPUT_PATH.open("rb") as f:
+        resp = BATCH_SESSION.post(
+            f"{OPENAI_BASE_URL}/files",
+            headers=headers,
+            data={"purpose": "batch"},
+            files={"file": (BATCH_INPUT_PATH.name, f)},
+            timeout=120
+        )
+    resp.raise_for_status()
+    input_file_id = resp.json()["id"]
+
+    resp = BATCH_SESSION.post(
+        f"{OPENAI_BASE_URL}/batches",
+        headers=headers,
+        json={
+            "input_file_id": input_file_id,
+            "endpoint": "/v1/chat/completions",
+            "completion_window": "24h",
+        },
+        timeout=30
     )
     resp.raise_for_status()
-    return resp.json()
+    batch = resp.json()
+    print(f"Created batch {batch['id']} ({len(leads)} requests)")
+
+    # Poll with exponential backoff until the batch finishes
+    delay = 5
+    while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+        time.sleep(delay)
+        delay = min(delay * 2, 300)
+        resp = SESSION.get(f"{OPENAI_BASE_URL}/batches/{batch['id']}", headers=headers, timeout=30)
+        resp.raise_for_status()
+        batch = resp.json()
+        counts = batch.get("request_counts") or {}
+        print(f"  Batch {batch['status']}: {counts.get('completed', 0)}/{counts.get('total', len(leads))}")
+
+    if batch["status"] != "completed":
+        raise RuntimeError(f"Batch {batch['id']} ended with status {batch['status']}")
+
+    # Successful requests land in the output file, failed ones in the error file
+    responses = {}
+    for file_key in ("output_file_id", "error_file_id"):
+        if not batch.get(file_key):
+            continue
+        resp = SESSION.get(
+            f"{OPENAI_BASE_URL}/files/{batch[file_key]}/content",
+            headers=headers,
+            timeout=120
+        )
+        resp.raise_for_status()
+        for line in resp.text.splitlines():
+            if line.strip():
+                item = json.loads(line)
+                responses[item["custom_id"]] = item
+
+    for lead in leads:
+        item = responses.get(str(lead.get('id')))
+        try:
+            if not item:
+                raise RuntimeError("No batch response")
+            error = batch_item_error(item)
+            if error:
+                raise RuntimeError(error)
+            content = message_text(item["response"]["body"]["choices"][0]["message"])
+            if is_complete_response(content):
+                cache_put(cache_key(build_prompt(lead), SYSTEM_PROMPT, model=model), content)
+            results.append(parse_response(lead, content))
+        except Exception as e:
+            results.append(error_result(lead, str(e)))
+    return results
+
+
+def lead_updates(result: dict) -> dict | None:
+    """Determine the Supabase update for a polish result, if any."""
+    if 'error' in result or not result.get('result'):
+        return None
+
+    r = result['result']
+    updates = {}
+
+    # If current contact is invalid
+    if not r.get('contact_name_valid'):
+        if r.get('new_contact_name'):
+            # Replace with valid name
+            updates['contact_name'] = r['new_contact_name']
+            updates['contact_role'] = r.get('new_contact_role')
+        elif result.get('original_contact'):
+            # No valid replacement - clear the garbage
+            updates['contact_name'] = None
+            updates['contact_role'] = None
+
+    # If Chinese rep and we identified Chinese staff (different from current)
+    if r.get('chinese_staff_name') and r['chinese_staff_name'] != result.get('original_contact'):
+        updates['contact_name'] = r['chinese_staff_name']
+        updates['contact_role'] = r.get('chinese_staff_role')
+
+    if not updates:
+        return None
+    return {
+        'id': result['id'],
+        'name': result['name'],
+        'original': result.get('original_contact'),
+        'updates': updates
+    }
+
+
+LEAD_COLUMNS = ("id", "name", "contact_name", "decision_makers", "chinese_rep_candidate")
+
+
+def fetch_leads_from_supabase(chinese_only: bool = False, limit: int = 0, columns: tuple = LEAD_COLUMNS):
+    """Yield leads from Supabase as they download, filtering and limiting server-side."""
+    url = f"{SUPABASE_URL}/rest/v1/leads?select={','.join(columns)}&order=id"
+    if chinese_only:
+        url += "&chinese_rep_candidate=eq.true"
+    if limit > 0:
+        url += f"&limit={limit}"
+    with SESSION.get(
+        url,
+        headers={**SUPABASE_HEADERS, 'Accept-Encoding': 'gzip'},
+        stream=True
+    ) as resp:
+        resp.raise_for_status()
+        if not HAS_IJSON:
+            yield from resp.json()
+            return
+        # Stream-decode the array so leads are handed out before the body finishes
+        resp.raw.decode_content = True
+        yield from ijson.items(resp.raw, 'item', use_float=True)
 
 
 def update_lead_in_supabase(lead_id: int, updates: dict) -> bool:
     """Update a lead in Supabase."""
-    resp = requests.patch(
+    resp = SESSION.patch(
         f'{SUPABASE_URL}/rest/v1/leads?id=eq.{lead_id}',
         headers={
-            'apikey': SUPABASE_KEY,
-            'Authorization': f'Bearer {SUPABASE_KEY}',
+            **SUPABASE_HEADERS,
             'Content-Type': 'application/json',
             'Prefer': 'return=minimal'
         },
@@ -167,11 +671,52 @@ def update_lead_in_supabase(lead_id: int, updates: dict) -> bool:
     return resp.status_code in (200, 204)
 
 
+def upsert_leads_in_supabase(rows: list) -> bool:
+    """Merge a list of partial lead rows (keyed by id) in one request.
+    A rejected request is reported with its status and body."""
+    resp = SESSION.post(
+        f'{SUPABASE_URL}/rest/v1/leads',
+        headers={
+            **SUPABASE_HEADERS,
+            'Content-Type': 'application/json',
+            'Prefer': 'resolution=merge-duplicates,return=minimal'
+        },
+        json=rows
+    )
+    if resp.status_code in (200, 201, 204):
+        return True
+    print(f"  Bulk upsert of {len(rows)} leads rejected ({resp.status_code}): {resp.text[:500]}")
+    return False
+
+
+def apply_updates(updates_to_apply: list) -> int:
+    """Bulk-apply updates; returns the number of leads updated."""
+    payload = [{'id': u['id'], **u['updates']} for u in updates_to_apply]
+    if not payload:
+        return 0
+    if len(payload) <= 1000:
+        chunks = [payload]
+    else:
+        chunks = [payload[i:i + UPSERT_CHUNK_SIZE] for i in range(0, len(payload), UPSERT_CHUNK_SIZE)]
+
+    def apply_chunk(chunk: list) -> int:
+        if upsert_leads_in_supabase(chunk):
+            return len(chunk)
+        # Fall back to per-row PATCH so one bad row doesn't sink the chunk
+        return sum(update_lead_in_supabase(row['id'], {k: v for k, v in row.items() if k != 'id'})
+                   for row in chunk)
+
+    with ThreadPoolExecutor(max_workers=min(len(chunks), MAX_WORKERS)) as executor:
+        return sum(executor.map(apply_chunk, chunks))
+
+
 def main():
     parser = argparse.ArgumentParser(description="LLM Polish Pass")
     parser.add_argument("--dry-run", action="store_true", help="Don't update database")
     parser.add_argument("--limit", type=int, default=0, help="Limit number of leads to process")
     parser.add_argument("--chinese-only", action="store_true", help="Only process Chinese rep candidates")
+    parser.add_argument("--batch", action="store_true", help="Use the OpenAI Batch API (cheaper, slower; for large runs)")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help=f"OpenAI model (default: {DEFAULT_MODEL})")
     args = parser.parse_args()
 
     if not OPENAI_API_KEY:
@@ -180,65 +725,33 @@ def main():
 
     # Fetch leads
     print("Fetching leads from Supabase...")
-    leads = fetch_leads_from_supabase()
-    print(f"Fetched {len(leads)} leads")
+    leads = fetch_leads_from_supabase(chinese_only=args.chinese_only, limit=args.limit)
+    kind = "Chinese rep candidates" if args.chinese_only else "leads"
 
-    # Filter if requested
-    if args.chinese_only:
-        leads = [l for l in leads if l.get('chinese_rep_candidate')]
-        print(f"Filtered to {len(leads)} Chinese rep candidates")
+    results = []
+    if args.batch:
+        leads = list(leads)
+        print(f"Fetched {len(leads)} {kind}")
+        if leads:
+            print(f"\nSubmitting {len(leads)} leads to the Batch API with {args.model}...")
+            results = run_batch(leads, args.model)
+    else:
+        # Process in parallel, submitting work as leads stream in
+        print(f"\nProcessing {kind} with {args.model}...")
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            polish = functools.partial(polish_group, model=args.model)
+            for i, group_results in enumerate(executor.map(polish, group_leads(leads)), 1):
+                results.extend(group_results)
 
-    if args.limit:
-        leads = leads[:args.limit]
-        print(f"Limited to {len(leads)} leads")
+                if i % 50 == 0:
+                    print(f"  Progress: {len(results)} leads")
 
-    if not leads:
+    if not results:
         print("No leads to process")
         return
 
-    # Process in parallel
-    print(f"\nProcessing {len(leads)} leads with {OPENAI_MODEL}...")
-    results = []
-    updates_to_apply = []
-
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        futures = {executor.submit(polish_lead, lead): lead['id'] for lead in leads}
-
-        for i, future in enumerate(as_completed(futures)):
-            result = future.result()
-            results.append(result)
-
-            if (i + 1) % 10 == 0:
-                print(f"  Progress: {i + 1}/{len(leads)}")
-
-            # Determine updates
-            if 'error' not in result and result.get('result'):
-                r = result['result']
-                updates = {}
-
-                # If current contact is invalid
-                if not r.get('contact_name_valid'):
-                    if r.get('new_contact_name'):
-                        # Replace with valid name
-                        updates['contact_name'] = r['new_contact_name']
-                        updates['contact_role'] = r.get('new_contact_role')
-                    elif result.get('original_contact'):
-                        # No valid replacement - clear the garbage
-                        updates['contact_name'] = None
-                        updates['contact_role'] = None
-
-                # If Chinese rep and we identified Chinese staff (different from current)
-                if r.get('chinese_staff_name') and r['chinese_staff_name'] != result.get('original_contact'):
-                    updates['contact_name'] = r['chinese_staff_name']
-                    updates['contact_role'] = r.get('chinese_staff_role')
-
-                if updates:
-                    updates_to_apply.append({
-                        'id': result['id'],
-                        'name': result['name'],
-                        'original': result.get('original_contact'),
-                        'updates': updates
-                    })
+    # Determine updates
+    updates_to_apply = [u for u in map(lead_updates, results) if u]
 
     # Summary
     print(f"\n=== Results ===")
@@ -258,11 +771,7 @@ def main():
 
     # Apply updates
     print(f"\nApplying {len(updates_to_apply)} updates to Supabase...")
-    success = 0
-    for u in updates_to_apply:
-        if update_lead_in_supabase(u['id'], u['updates']):
-            success += 1
-
+    success = apply_updates(updates_to_apply)
     print(f"Updated: {success}/{len(updates_to_apply)}")
 
 
@@ -6,25 +6,30 @@ Usage:
 """
 
 import argparse
+import bisect
+import functools
 import json
+import logging
 import os
+import random
 import re
+import shelve
+import sys
 import time
 from pathlib import Path
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import TYPE_CHECKING
 
-try:
-    from supabase import create_client, Client
-except ImportError:
-    print("Install supabase: pip install supabase")
-    exit(1)
+# supabase (with httpx/postgrest) and geopy are slow to import, so they are
+# imported where they're used; load/clean/dry-run never pay for them
+if TYPE_CHECKING:
+    from supabase import Client
 
 try:
-    from geopy.geocoders import Nominatim, ArcGIS
-    from geopy.extra.rate_limiter import RateLimiter
-    HAS_GEOPY = True
+    # orjson is several times faster than json on dossier-sized objects
+    from orjson import loads as json_loads
 except ImportError:
-    HAS_GEOPY = False
+    json_loads = json.loads
 
 try:
     from dotenv import load_dotenv
@@ -32,84 +37,253 @@ try:
 except ImportError:
     pass
 
+GEOCODE_CACHE_PATH = Path("data/geocode_cache.db")
+ARCGIS_BATCH_URL = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/geocodeAddresses"
+ARCGIS_BATCH_SIZE = 150
+GEOCODE_WORKERS = 10
+GEOCODE_ATTEMPTS = 3
+
+REQUIRED_DOSSIER_KEYS = ("lead_id", "address")
+
+# Scores at or above each threshold move up one priority label
+_PRIORITY_THRESHOLDS = (30, 40, 50)
+_PRIORITY_LABELS = ("low", "medium", "high", "urgent")
+
+log = logging.getLogger("sync")
+
+# Shared by all geocoding workers; built on first use in geocode_rows
+_GEOLOCATOR = None
+
+# Rows per bulk upsert request
+BATCH_SIZE = 500
+UPSERT_WORKERS = 8
+UPSERT_ATTEMPTS = 3
+TRANSIENT_STATUS = {"429", "500", "502", "503", "504"}
+# postgrest-py only reports the HTTP status as APIError.code for non-JSON
+# bodies; JSON errors carry a PostgREST/SQLSTATE code instead. These are the
+# ones worth retrying: PostgREST can't reach or query the database (503s),
+# statement timeout, serialization failure, deadlock, too many connections.
+TRANSIENT_PG_CODES = {"PGRST000", "PGRST001", "PGRST002", "PGRST003", "57014", "40001", "40P01", "53300"}
+
+# Citation markers like " [40-char hex hash]"
+_CITATION_RE = re.compile(r'\s*\[[a-f0-9]{40}\]')
+
+# Words that mark a "name" as an organization, program or place
+GARBAGE_PATTERNS = frozenset({
+    'place', 'house', 'home', 'lodge', 'manor', 'centre', 'center',
+    'residence', 'hope', 'care', 'services', 'program', 'health',
+    'healthcare', 'homecare', 'eldercare',
+    'living', 'community', 'support', 'society', 'international',
+    'fellowship', 'association', 'foundation', 'organization', 'org',
+    'scarborough', 'toronto', 'ottawa', 'hamilton', 'london', 'ontario',
+    'north', 'south', 'east', 'west', 'central',
+    'next level', 'the mind', 'action canada', 'rotary',
+    'shelter', 'youth', 'housing', 'after-care', 'mental', 'addiction',
+    'seniors', 'elderly', 'assisted', 'nursing', 'rehab', 'recovery',
+    'clinic', 'hospital', 'medical', 'wellness', 'outreach',
+    'ministry', 'government', 'provincial', 'federal', 'municipal',
+    'inc', 'ltd', 'corp', 'llc', 'limited',
+})
+# Whole words only (plus plurals), so 'inc' no longer rejects "Vincent" or
+# 'care' "Carey", while "Group Homes" is still caught by 'home'
+_GARBAGE_RE = re.compile(
+    r'\b(?:' + '|'.join(re.escape(p) for p in sorted(GARBAGE_PATTERNS)) + r')(?:e?s)?\b',
+    re.IGNORECASE,
+)
+
 
 def strip_citation_hashes(text: str) -> str:
     """Remove [hash] citation markers from text."""
-    if not text:
-        return text
-    # Remove patterns like [40-char hex hash]
-    return re.sub(r'\s*\[[a-f0-9]{40}\]', '', text).strip()
+    return _CITATION_RE.sub('', text).strip() if text else text
 
 
-def geocode_single(args: tuple) -> tuple[int, float | None, float | None]:
-    """Geocode a single address. Returns (index, lat, lon)."""
-    idx, address, geolocator = args
-
-    if not address:
-        return (idx, None, None)
-
-    # Clean up address for geocoding
-    search_addr = address
+def geocode_query(address: str) -> str:
+    """Clean up an address for geocoding."""
     if 'ON' not in address.upper() and 'Ontario' not in address:
-        search_addr = f"{address}, Ontario, Canada"
-    elif 'Canada' not in address:
-        search_addr = f"{address}, Canada"
+        return f"{address}, Ontario, Canada"
+    if 'Canada' not in address:
+        return f"{address}, Canada"
+    return address
 
-    try:
-        location = geolocator.geocode(search_addr, timeout=10)
-        if location:
-            return (idx, location.latitude, location.longitude)
-    except Exception:
-        pass
-    return (idx, None, None)
 
+def geocode_cache_key(address: str) -> str:
+    """Normalize an address into a geocode cache key."""
+    return geocode_query(address).lower().strip()
 
-def geocode_rows(rows: list[dict], skip_existing: bool = True) -> list[dict]:
-    """Add lat/lon to rows using parallel ArcGIS geocoding."""
-    if not HAS_GEOPY:
-        print("Warning: geopy not installed, skipping geocoding")
-        return rows
 
-    # Use ArcGIS - faster, no strict rate limit, no API key needed
-    geolocator = ArcGIS(timeout=10)
+def geocode_single(args: tuple) -> tuple[int, float | None, float | None]:
+    """Geocode a single address. Returns (index, lat, lon)."""
+    from geopy.exc import (
+        GeocoderAuthenticationFailure,
+        GeocoderInsufficientPrivileges,
+        GeocoderQueryError,
+        GeocoderServiceError,
+    )
 
-    to_geocode = []
-    for i, row in enumerate(rows):
-        if skip_existing and row.get("lat") and row.get("lon"):
-            continue
-        if row.get("address"):
-            to_geocode.append((i, row["address"], geolocator))
+    idx, address = args
 
-    if not to_geocode:
-        print("All rows already have coordinates or no addresses")
-        return rows
+    if not address:
+        return (idx, None, None)
 
-    print(f"Geocoding {len(to_geocode)} addresses with ArcGIS (parallel)...")
+    search_addr = geocode_query(address)
+    for attempt in range(GEOCODE_ATTEMPTS):
+        try:
+            location = _GEOLOCATOR.geocode(search_addr, timeout=10)
+            if location:
+                return (idx, location.latitude, location.longitude)
+            break
+        except (GeocoderQueryError, GeocoderAuthenticationFailure, GeocoderInsufficientPrivileges):
+            # Bad address or bad credentials - retrying won't help
+            break
+        except GeocoderServiceError:
+            # Timeouts, throttling and 5xx: back off with jitter and try again
+            if attempt < GEOCODE_ATTEMPTS - 1:
+                time.sleep(0.2 * 2 ** attempt + random.random() * 0.1)
+        except Exception as e:
+            log.debug("Geocoding %r failed: %s", search_addr, e)
+            break
+    return (idx, None, None)
 
-    success = 0
-    completed = 0
 
-    # Use 10 parallel workers
-    with ThreadPoolExecutor(max_workers=10) as executor:
+def geocode_parallel(to_geocode: list[tuple]):
+    """Geocode addresses one per request on parallel threads. Yields (index, lat, lon)."""
+    with ThreadPoolExecutor(max_workers=GEOCODE_WORKERS) as executor:
         futures = {executor.submit(geocode_single, args): args[0] for args in to_geocode}
 
         for future in as_completed(futures):
             try:
-                idx, lat, lon = future.result()
-                if lat and lon:
-                    rows[idx]["lat"] = lat
-                    rows[idx]["lon"] = lon
-                    success += 1
-                completed += 1
+                yield future.result()
+            except Exception:
+                yield (futures[future], None, None)
+
+
+def geocode_batch(to_geocode: list[tuple], api_key: str):
+    """Geocode addresses with ArcGIS batch requests. Yields (index, lat, lon).
+
+    Batch geocoding needs an ArcGIS API key. Requests are sent one at a time,
+    as the World service asks of batch clients. Transient failures are retried;
+    a chunk that still fails yields (index, None, None) for its addresses.
+    """
+    import httpx
+
+    with httpx.Client(timeout=120) as client:
+        for start in range(0, len(to_geocode), ARCGIS_BATCH_SIZE):
+            chunk = to_geocode[start:start + ARCGIS_BATCH_SIZE]
+            records = [
+                {"attributes": {"OBJECTID": idx, "SingleLine": geocode_query(address)}}
+                for idx, address in chunk
+            ]
+            form = {
+                "addresses": json.dumps({"records": records}),
+                "sourceCountry": "CAN",
+                "outSR": 4326,
+                "f": "json",
+                "token": api_key,
+            }
+
+            data = None
+            for attempt in range(GEOCODE_ATTEMPTS):
+                try:
+                    resp = client.post(ARCGIS_BATCH_URL, data=form)
+                    resp.raise_for_status()
+                    data = resp.json()
+                    if "error" not in data:
+                        break
+                    # ArcGIS reports failures in a 200 body; only its 5xx/429 codes are worth retrying
+                    error = data["error"]
+                    reason = f"{error.get('code')} {error.get('message')}"
+                    transient = str(error.get("code")) in TRANSIENT_STATUS
+                except httpx.HTTPStatusError as e:
+                    reason = f"HTTP {e.response.status_code}"
+                    transient = str(e.response.status_code) in TRANSIENT_STATUS
+                except (httpx.TransportError, ValueError) as e:
+                    # Timeouts, dropped connections and truncated JSON bodies
+                    reason = str(e) or type(e).__name__
+                    transient = True
+                data = None
+                if not transient or attempt == GEOCODE_ATTEMPTS - 1:
+                    log.warning("ArcGIS batch of %d addresses failed (%s), skipping", len(chunk), reason)
+                    break
+                time.sleep(2 ** attempt + random.random())
+
+            found = {}
+            for loc in (data or {}).get("locations", []):
+                point = loc.get("location") or {}
+                if loc.get("score", 0) > 0 and isinstance(point.get("x"), (int, float)):
+                    found[loc["attributes"]["ResultID"]] = (point["y"], point["x"])
+            for idx, _ in chunk:
+                lat, lon = found.get(idx, (None, None))
+                yield (idx, lat, lon)
+
+
+def geocode_rows(rows: list[dict], to_geocode: list[tuple[int, str]]) -> int:
+    """Fill lat/lon on the queued (index, address) rows using ArcGIS geocoding
+    (batch with ARCGIS_API_KEY, else parallel). Returns how many rows got coordinates."""
+    global _GEOLOCATOR
+    api_key = os.getenv("ARCGIS_API_KEY")
+    if not api_key and _GEOLOCATOR is None:
+        try:
+            from geopy.adapters import RequestsAdapter, requests_available
+            from geopy.geocoders import ArcGIS
+        except ImportError:
+            log.warning("geopy not installed, skipping geocoding")
+            return 0
+
+        # Use ArcGIS - faster, no strict rate limit, no API key needed.
+        # All workers share this geolocator's keep-alive session, so size its
+        # connection pool to the worker count instead of geopy's default.
+        adapter_factory = None
+        if requests_available:
+            adapter_factory = functools.partial(RequestsAdapter, pool_connections=1, pool_maxsize=GEOCODE_WORKERS)
+        _GEOLOCATOR = ArcGIS(timeout=10, adapter_factory=adapter_factory)
+
+    # Addresses rarely move, so successful lookups are kept across runs
+    GEOCODE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+    cache = shelve.open(str(GEOCODE_CACHE_PATH))
+    try:
+        uncached = []
+        for idx, address in to_geocode:
+            key = geocode_cache_key(address)
+            if key in cache:
+                rows[idx]["lat"], rows[idx]["lon"] = cache[key]
+            else:
+                uncached.append((idx, address))
+
+        cached = len(to_geocode) - len(uncached)
+        if cached:
+            log.info("Loaded %d coordinates from geocode cache", cached)
+
+        to_geocode = uncached
+        if not to_geocode:
+            log.info("All rows already have coordinates or no addresses")
+            return cached
+
+        if api_key:
+            log.info("Geocoding %d addresses with ArcGIS (batch)...", len(to_geocode))
+            results = geocode_batch(to_geocode, api_key)
+        else:
+            log.info("Geocoding %d addresses with ArcGIS (parallel)...", len(to_geocode))
+            results = geocode_parallel(to_geocode)
+
+        success = 0
+        completed = 0
 
-                if completed % 50 == 0:
-                    print(f"  Progress: {completed}/{len(to_geocode)} ({success} successful)")
+        for idx, lat, lon in results:
+            if lat and lon:
+                rows[idx]["lat"] = lat
+                rows[idx]["lon"] = lon
+                # Only this thread touches the shelf
+                cache[geocode_cache_key(rows[idx]["address"])] = (lat, lon)
+                success += 1
+            completed += 1
 
-            except Exception as e:
-                completed += 1
+            if completed % 50 == 0:
+                log.info("  Progress: %d/%d (%d successful)", completed, len(to_geocode), success)
 
-    print(f"Geocoded {success}/{len(to_geocode)} addresses")
-    return rows
+        log.info("Geocoded %d/%d addresses", success, len(to_geocode))
+        return cached + success
+    finally:
+        cache.close()
 
 
 def load_dossiers(path: Path) -> list[dict]:
@@ -117,28 +291,47 @@ def load_dossiers(path: Path) -> list[dict]:
     if not path.exists():
         return []
     dossiers = []
-    with path.open("r", encoding="utf-8") as f:
+    # Feed raw bytes straight to the parser; both parsers accept trailing
+    # whitespace, and blank lines simply fail to parse
+    with path.open("rb", buffering=1 << 20) as f:
         for line in f:
-            line = line.strip()
-            if line:
-                try:
-                    dossiers.append(json.loads(line))
-                except json.JSONDecodeError:
-                    continue
+            try:
+                dossiers.append(json_loads(line))
+            except json.JSONDecodeError:  # orjson.JSONDecodeError subclasses this
+                continue
     return dossiers
 
 
+def check_dossier_shape(path: Path) -> str | None:
+    """Check the first dossier in the file has the fields the sync needs.
+
+    Returns an error message, or None if the input looks usable.
+    """
+    if not path.exists():
+        return f"No dossiers found at {path}"
+    with path.open("rb") as f:
+        for line in f:
+            if line.strip():
+                break
+        else:
+            return f"No dossiers found at {path}"
+    try:
+        first = json_loads(line)
+    except json.JSONDecodeError as e:
+        return f"First line of {path} is not valid JSON: {e}"
+    if not isinstance(first, dict):
+        return f"First line of {path} is not a JSON object"
+    missing = [k for k in REQUIRED_DOSSIER_KEYS if k not in first]
+    if missing:
+        return f"Dossiers in {path} are missing required fields: {', '.join(missing)}"
+    return None
+
+
 def score_to_priority(score: int) -> str:
     """Convert score to priority level."""
     if score is None:
         return "medium"
-    if score >= 50:
-        return "urgent"
-    if score >= 40:
-        return "high"
-    if score >= 30:
-        return "medium"
-    return "low"
+    return _PRIORITY_LABELS[bisect.bisect_right(_PRIORITY_THRESHOLDS, score)]
 
 
 def is_valid_person_name(name: str) -> bool:
@@ -146,71 +339,51 @@ def is_valid_person_name(name: str) -> bool:
     if not name:
         return False
     name = name.strip()
-    words = name.split()
 
-    # Must have 2-4 words (first + last, maybe middle)
-    if len(words) < 2 or len(words) > 5:
-        return False
-
-    # Not too long
+    # Not too long (checked before splitting so long strings skip the list)
     if len(name) > 40:
         return False
 
-    # Filter out obvious garbage patterns
-    garbage_patterns = [
-        'place', 'house', 'home', 'lodge', 'manor', 'centre', 'center',
-        'residence', 'hope', 'care', 'services', 'program', 'health',
-        'living', 'community', 'support', 'society', 'international',
-        'fellowship', 'association', 'foundation', 'organization', 'org',
-        'scarborough', 'toronto', 'ottawa', 'hamilton', 'london', 'ontario',
-        'north', 'south', 'east', 'west', 'central',
-        'next level', 'the mind', 'action canada', 'rotary',
-        'shelter', 'youth', 'housing', 'after-care', 'mental', 'addiction',
-        'seniors', 'elderly', 'assisted', 'nursing', 'rehab', 'recovery',
-        'clinic', 'hospital', 'medical', 'wellness', 'outreach',
-        'ministry', 'government', 'provincial', 'federal', 'municipal',
-        'inc', 'ltd', 'corp', 'llc', 'limited',
-    ]
-    name_lower = name.lower()
-    if any(pattern in name_lower for pattern in garbage_patterns):
+    words = name.split()
+
+    # Must have 2-4 words (first + last, maybe middle)
+    if len(words) < 2 or len(words) > 5:
         return False
 
-    # Each word should be capitalized properly (first letter upper, rest lower/mixed)
+    # Each word should be capitalized properly (first letter upper, rest lower/mixed).
+    # Cheap, so it runs before the pattern scan
     for word in words:
         if len(word) <= 1:
             continue
         if not word[0].isupper():
             return False
 
+    # Filter out obvious garbage patterns
+    if _GARBAGE_RE.search(name):
+        return False
+
     return True
 
 
 def clean_decision_makers(dms: list) -> list:
     """Filter out garbage decision makers."""
-    cleaned = []
-    for dm in dms:
-        if not isinstance(dm, dict):
-            continue
-        name = dm.get("name", "")
-        if is_valid_person_name(name):
-            cleaned.append(dm)
-    return cleaned
+    return [dm for dm in dms if isinstance(dm, dict) and is_valid_person_name(dm.get("name", ""))]
+
+
+def clean_talking_point(p):
+    """Strip citation hashes from one talking point, copying it only if it changes."""
+    if isinstance(p, str):
+        return strip_citation_hashes(p)
+    if isinstance(p, dict) and "point" in p:
+        cleaned = strip_citation_hashes(p["point"])
+        if cleaned != p["point"]:
+            return {**p, "point": cleaned}
+    return p
 
 
 def clean_talking_points(points: list) -> list:
     """Strip citation hashes from talking points."""
-    cleaned = []
-    for p in points:
-        if isinstance(p, dict):
-            cleaned_point = dict(p)
-            if "point" in cleaned_point:
-                cleaned_point["point"] = strip_citation_hashes(cleaned_point["point"])
-            cleaned.append(cleaned_point)
-        elif isinstance(p, str):
-            cleaned.append(strip_citation_hashes(p))
-        else:
-            cleaned.append(p)
-    return cleaned
+    return [clean_talking_point(p) for p in points]
 
 
 def clean_chinese_rep_fit(fit: dict, valid_dms: list) -> dict:
@@ -219,14 +392,24 @@ def clean_chinese_rep_fit(fit: dict, valid_dms: list) -> dict:
         return fit
 
     # Get valid person names
-    valid_names = {dm.get("name", "").lower() for dm in valid_dms}
+    valid_names = {dm.get("name", "").lower() for dm in valid_dms} - {""}
+
+    # With more than a couple of names, one alternation scan per detail beats
+    # a substring test per name; for one or two the plain test is cheaper
+    names_re = None
+    if len(valid_names) > 2:
+        names_re = re.compile('|'.join(re.escape(n) for n in valid_names))
 
     # Filter reasons to only include those referencing valid names
     cleaned_reasons = []
     for reason in fit.get("reasons", []):
         detail = reason.get("detail", "").lower()
         # Check if any valid name is mentioned in the reason
-        if any(name in detail for name in valid_names if name):
+        if names_re:
+            mentioned = names_re.search(detail) is not None
+        else:
+            mentioned = any(name in detail for name in valid_names)
+        if mentioned:
             cleaned_reasons.append(reason)
 
     # If no valid reasons remain, downgrade the fit
@@ -246,59 +429,123 @@ def clean_chinese_rep_fit(fit: dict, valid_dms: list) -> dict:
 
 def dossier_to_row(d: dict) -> dict:
     """Convert dossier to Supabase row format."""
+    g = d.get
+
     # Clean decision makers and get primary contact
-    dms = clean_decision_makers(d.get("decision_makers", []))
-    primary_dm = dms[0] if dms else {}
+    dms = clean_decision_makers(g("decision_makers", []))
+    if dms:
+        first = dms[0]
+        contact_name = first.get("name")
+        contact_email = first.get("email")
+        contact_role = first.get("title")
+    else:
+        contact_name = contact_email = contact_role = None
 
     # Re-evaluate Chinese rep fit based on valid decision makers
-    fit = clean_chinese_rep_fit(d.get("chinese_rep_fit", {}), dms)
+    fit = clean_chinese_rep_fit(g("chinese_rep_fit", {}), dms)
+    overall_priority = g("overall_priority", 0)
 
     return {
-        "lead_id": d.get("lead_id"),
-        "name": d.get("name"),
-        "address": d.get("address"),
-        "phone": d.get("phone"),
-        "city": d.get("city"),
-        "website": d.get("website") or d.get("listing_url"),
+        "lead_id": g("lead_id"),
+        "name": g("name"),
+        "address": g("address"),
+        "phone": g("phone"),
+        "city": g("city"),
+        "website": g("website") or g("listing_url"),
         "source": "dossier_pipeline",
 
         # Enrichment scores
-        "score": d.get("overall_priority", 0),
-        "priority": score_to_priority(d.get("overall_priority", 0)),
-        "overall_priority": d.get("overall_priority"),
-        "independence_score": d.get("independence_score"),
-        "contactability_score": d.get("contactability_score"),
-        "pharma_fit_score": d.get("pharma_fit_score"),
-        "partnership_openness_score": d.get("partnership_openness_score"),
-        "capacity_score": d.get("capacity_score"),
-        "sales_brief": strip_citation_hashes(d.get("sales_brief", "")),
+        "score": overall_priority,
+        "priority": score_to_priority(overall_priority),
+        "overall_priority": g("overall_priority"),
+        "independence_score": g("independence_score"),
+        "contactability_score": g("contactability_score"),
+        "pharma_fit_score": g("pharma_fit_score"),
+        "partnership_openness_score": g("partnership_openness_score"),
+        "capacity_score": g("capacity_score"),
+        "sales_brief": strip_citation_hashes(g("sales_brief", "")),
 
         # Dossier content as JSON
         "decision_makers": dms,
-        "services_offered": d.get("services_offered", []),
-        "talking_points": clean_talking_points(d.get("talking_points", [])),
-        "resident_populations": d.get("resident_populations", []),
-        "medication_signals": d.get("medication_management_signals", []),
-        "partnerships": d.get("partnerships_and_affiliations", []),
-        "next_step": d.get("next_step", {}),
+        "services_offered": g("services_offered", []),
+        "talking_points": clean_talking_points(g("talking_points", [])),
+        "resident_populations": g("resident_populations", []),
+        "medication_signals": g("medication_management_signals", []),
+        "partnerships": g("partnerships_and_affiliations", []),
+        "next_step": g("next_step", {}),
 
         # Primary contact
-        "contact_name": primary_dm.get("name"),
-        "contact_email": primary_dm.get("email"),
-        "contact_role": primary_dm.get("title"),
+        "contact_name": contact_name,
+        "contact_email": contact_email,
+        "contact_role": contact_role,
 
         # Language & Chinese rep
-        "languages_supported": d.get("languages_supported", []),
+        "languages_supported": g("languages_supported", []),
         "chinese_rep_candidate": fit.get("is_candidate", False),
         "chinese_rep_confidence": fit.get("confidence", "none"),
         "chinese_rep_reasons": fit.get("reasons", []),
 
         # Coordinates (will be filled by geocoding)
-        "lat": d.get("lat"),
-        "lon": d.get("lon") or d.get("lon"),
+        "lat": g("lat"),
+        "lon": g("lon") or g("lng"),
     }
 
 
+def is_transient_error(e: Exception) -> bool:
+    """Check if a Supabase error is worth retrying (rate limit, 5xx, network)."""
+    import httpx
+    from postgrest.exceptions import APIError
+
+    if isinstance(e, httpx.TransportError):
+        return True
+    if not isinstance(e, APIError):
+        return False
+    # A JSON error with no code comes from the API gateway (e.g. its 429)
+    if e.code is None:
+        return True
+    return str(e.code) in TRANSIENT_STATUS or e.code in TRANSIENT_PG_CODES
+
+
+def upsert_rows(supabase: "Client", rows: list[dict] | dict) -> None:
+    """Upsert rows based on lead_id, retrying transient errors with backoff."""
+    from postgrest.types import ReturnMethod
+
+    for attempt in range(UPSERT_ATTEMPTS):
+        try:
+            # Fresh query builder per call so threads never share one
+            # return=minimal: we discard the upserted rows, so don't download them
+            supabase.table("leads").upsert(
+                rows,
+                on_conflict="lead_id",
+                returning=ReturnMethod.minimal
+            ).execute()
+            return
+        except Exception as e:
+            if attempt == UPSERT_ATTEMPTS - 1 or not is_transient_error(e):
+                raise
+            time.sleep(2 ** attempt)
+
+
+def sync_chunk(supabase: "Client", chunk: list[dict]) -> tuple[int, list[tuple[str, str]]]:
+    """Upsert a chunk of rows. Returns (success count, [(name, error)])."""
+    try:
+        upsert_rows(supabase, chunk)
+        return (len(chunk), [])
+    except Exception:
+        pass
+
+    # Fall back to one row at a time so a bad record doesn't lose the chunk
+    success = 0
+    errors = []
+    for row in chunk:
+        try:
+            upsert_rows(supabase, row)
+            success += 1
+        except Exception as e:
+            errors.append((row.get("name", "unknown"), str(e)))
+    return (success, errors)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Sync dossiers to Supabase")
     parser.add_argument("--input", default="data/enriched/leads.jsonl")
@@ -306,6 +553,8 @@ def main():
     parser.add_argument("--skip-geocoding", action="store_true", help="Skip geocoding step")
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO, format="%(message)s", stream=sys.stdout)
+
     # Check env vars
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY")
@@ -315,8 +564,24 @@ def main():
         print("You can add these to a .env file")
         return
 
-    # Load dossiers
+    # Validate the input shape before doing any real work
     input_path = Path(args.input)
+    error = check_dossier_shape(input_path)
+    if error:
+        print(f"Error: {error}")
+        return
+
+    # Connect to Supabase now so credential problems surface before geocoding
+    supabase = None
+    if not args.dry_run:
+        try:
+            from supabase import create_client
+        except ImportError:
+            print("Install supabase: pip install supabase")
+            return
+        supabase = create_client(url, key)
+
+    # Load dossiers
     dossiers = load_dossiers(input_path)
 
     if not dossiers:
@@ -325,21 +590,28 @@ def main():
 
     print(f"Loaded {len(dossiers)} dossiers")
 
-    # Convert to rows
-    rows = [dossier_to_row(d) for d in dossiers]
+    # Convert to rows, queueing geocoding and counting stats in the same pass
+    rows = [None] * len(dossiers)
+    to_geocode = []
+    chinese_candidates = 0
+    with_coords = 0
+    for i, d in enumerate(dossiers):
+        row = dossier_to_row(d)
+        if args.skip_geocoding:
+            # Remove lat/lon from rows so we don't overwrite existing coordinates
+            row.pop("lat", None)
+            row.pop("lon", None)
+        elif row.get("lat") and row.get("lon"):
+            with_coords += 1
+        elif row.get("address"):
+            to_geocode.append((i, row["address"]))
+        chinese_candidates += bool(row["chinese_rep_candidate"])
+        rows[i] = row
 
     # Geocode addresses
     if not args.skip_geocoding:
-        rows = geocode_rows(rows)
-    else:
-        # Remove lat/lon from rows so we don't overwrite existing coordinates
-        for row in rows:
-            row.pop("lat", None)
-            row.pop("lon", None)
+        with_coords += geocode_rows(rows, to_geocode)
 
-    # Count stats
-    chinese_candidates = sum(1 for r in rows if r["chinese_rep_candidate"])
-    with_coords = sum(1 for r in rows if r.get("lat") and r.get("lon"))
     print(f"Chinese rep candidates: {chinese_candidates}")
     print(f"With coordinates: {with_coords}/{len(rows)}")
 
@@ -351,25 +623,20 @@ def main():
             print(f"  ... and {len(rows) - 5} more")
         return
 
-    # Connect to Supabase
-    supabase: Client = create_client(url, key)
-
     # Upsert rows (insert or update based on lead_id)
     print(f"\nSyncing {len(rows)} leads to Supabase...")
 
     success = 0
     errors = []
 
-    for row in rows:
-        try:
-            # Upsert based on lead_id
-            result = supabase.table("leads").upsert(
-                row,
-                on_conflict="lead_id"
-            ).execute()
-            success += 1
-        except Exception as e:
-            errors.append((row.get("name", "unknown"), str(e)))
+    chunks = [rows[i:i + BATCH_SIZE] for i in range(0, len(rows), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=UPSERT_WORKERS) as executor:
+        futures = [executor.submit(sync_chunk, supabase, chunk) for chunk in chunks]
+
+        for future in as_completed(futures):
+            chunk_success, chunk_errors = future.result()
+            success += chunk_success
+            errors.extend(chunk_errors)
 
     print(f"\nSync complete:")
     print(f"  Success: {success}")